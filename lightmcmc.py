@@ -1,25 +1,29 @@
 #!/usr/bin/python
 
-from __future__ import division
 from collections import Counter
-from scipy.stats.distributions import binom
 from datetime import datetime
-from pytools import timedelta_to_seconds
+from functools import lru_cache
+from math import prod as product
+from multiprocessing import cpu_count, current_process, get_context
 import functools
+import math
 import numpy as np
-import operator
+import pickle
 import random
 try:
     from parallel import mapp
 except ImportError:
-    mapp = map
+    mapp = None
 
 
 # --------------------------------------------------------------------
 # Utils
 
-def product(seq):
-    return functools.reduce(operator.mul, seq, 1)
+NEG_INF = float("-inf")
+
+
+def safe_log(x):
+    return math.log(x) if x > 0 else NEG_INF
 
 
 def histogram(xs):
@@ -27,19 +31,145 @@ def histogram(xs):
     return sorted([(x, i / xlen) for (x, i) in Counter(xs).items()])
 
 
+class RandomPool(object):
+    """Hands out scalar uniforms from a buffer that is refilled in bulk."""
+
+    def __init__(self, seed=None, size=65536):
+        self.size = size
+        self.seed(seed)
+
+    def seed(self, seed):
+        self.rng = np.random.default_rng(seed)
+        self.idx = self.size
+        self.buf = None
+
+    def getstate(self):
+        return self.rng.bit_generator.state, self.buf, self.idx
+
+    def setstate(self, state):
+        self.rng.bit_generator.state, self.buf, self.idx = state
+
+    def uniform(self):
+        if self.idx >= self.size:
+            self.buf = self.rng.random(self.size).tolist()
+            self.idx = 0
+        u = self.buf[self.idx]
+        self.idx += 1
+        return u
+
+
+_pool = RandomPool()
+
+
 def flip(weight=0.5):
-    return np.random.uniform(0, 1) <= weight
+    return _pool.uniform() <= weight
+
+
+def flips(weight, size):
+    return _pool.rng.random(size) <= weight
+
+
+@lru_cache(maxsize=1024)
+def _alias_table(ps):
+    # Vose's alias method: O(n) setup, O(1) per sample.
+    n = len(ps)
+    total = sum(ps)
+    scaled = [p * n / total for p in ps]
+    prob = [1.0] * n
+    alias = list(range(n))
+    small = [i for (i, p) in enumerate(scaled) if p < 1]
+    large = [i for (i, p) in enumerate(scaled) if p >= 1]
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] = (scaled[l] + scaled[s]) - 1
+        if scaled[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
 
 
 def discrete(ps):
-    c = np.cumsum(ps)
-    y = np.random.uniform(0, 1)
-    return np.searchsorted(c, y)
+    prob, alias = _alias_table(tuple(np.asarray(ps, dtype=float).tolist()))
+    u = _pool.uniform() * len(prob)
+    i = int(u)
+    return i if u - i < prob[i] else alias[i]
 
 
 def random_seed(seed):
     np.random.seed(seed)
     random.seed(seed)
+    _pool.seed(seed)
+
+
+def _random_state():
+    return np.random.get_state(), random.getstate(), _pool.getstate()
+
+
+def _set_random_state(state):
+    np_state, py_state, pool_state = state
+    np.random.set_state(np_state)
+    random.setstate(py_state)
+    _pool.setstate(pool_state)
+
+
+# Set in each worker process by the pool initializer, never in the parent.
+_process_map_fn = None
+
+
+def _process_map_init(f):
+    global _process_map_fn
+    _process_map_fn = f
+
+
+def _process_map_worker(args):
+    seed, x = args
+    random_seed(seed)
+    return _process_map_fn(x)
+
+
+def _can_send(context, f):
+    # Under fork the workers inherit f; other start methods pickle it.
+    if context.get_start_method() == "fork":
+        return True
+    try:
+        pickle.dumps(f)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return False
+    return True
+
+
+def process_map(f, xs, processes=None, seeds=None):
+    """Map f over xs in worker processes, seeding the RNGs per item."""
+    xs = list(xs)
+    if seeds is None:
+        seeds = _pool.rng.integers(2 ** 32, size=len(xs)).tolist()
+    processes = min(processes or cpu_count(), len(xs))
+    context = get_context()
+    if (processes < 2 or current_process().daemon or
+            not _can_send(context, f)):
+        state = _random_state()
+        try:
+            results = []
+            for (seed, x) in zip(seeds, xs):
+                random_seed(seed)
+                results.append(f(x))
+        finally:
+            _set_random_state(state)
+        return results
+    pool = context.Pool(processes, _process_map_init, (f,))
+    try:
+        return pool.map(_process_map_worker, list(zip(seeds, xs)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if mapp is None:
+    mapp = process_map
 
 
 def memoize(obj):
@@ -66,21 +196,27 @@ def sample_dict_subset(dic, subset_size):
 # Rejection
 
 def single_rejection(model, condition, query):
-    _, value = model({}, -1)
+    _, value = model(World(), -1)
     while not condition(value):
-        _, value = model({}, -1)
+        _, value = model(World(), -1)
     return query(value)
 
 
 def rejection(model, condition, query, num_samples):
+    return list(mapp(lambda _: single_rejection(model, condition, query),
+                     range(num_samples)))
+
+
+def rejection_batch(model_batch, condition, query, num_samples,
+                    batch_size=1000):
+    """Rejection sampling for models that return arrays of candidates."""
     samples = []
-    for _ in range(int(num_samples / 100)):
-        samples += mapp(lambda _: single_rejection(model, condition, query),
-                        range(100))
-    if num_samples % 100:
-        samples += mapp(lambda _: single_rejection(model, condition, query),
-                        range(num_samples % 100))
-    return samples
+    while len(samples) < num_samples:
+        values = model_batch(batch_size)
+        keep = condition(values)
+        accepted = dict((k, v[keep]) for (k, v) in values.items())
+        samples += np.asarray(query(accepted)).tolist()
+    return samples[:num_samples]
 
 
 # --------------------------------------------------------------------
@@ -92,6 +228,8 @@ class ZeroProbabilityException(Exception):
 
 class Choice(object):
 
+    __slots__ = ("sampler", "scorer", "description")
+
     def __init__(self, sampler, scorer, description):
         self.sampler = sampler
         self.scorer = scorer
@@ -100,9 +238,12 @@ class Choice(object):
     def sample(self, world, name, tick):
         if name in world:
             draw = world[name]
-            draw.choice = self
             draw.tick_touched = tick
-            if draw.score == 0:
+            if draw.choice is not self:
+                world.record(name)
+                draw.choice = self
+                world.rescore(draw, safe_log(self.scorer(draw.value)))
+            if draw._logscore == NEG_INF:
                 raise ZeroProbabilityException
             return draw.value
         else:
@@ -114,11 +255,17 @@ class Choice(object):
     def set(self, world, name, tick, fixed_val):
         if name in world:
             draw = world[name]
-            draw.choice = self
             draw.tick_touched = tick
-            draw.value = fixed_val
-            draw.fixed = True
-            if draw.score == 0:
+            if (draw.choice is not self or draw.value != fixed_val or
+                    not draw.fixed):
+                world.record(name)
+                draw.choice = self
+                draw.value = fixed_val
+                if not draw.fixed:
+                    draw.fixed = True
+                    world.set_proposable(name, False)
+                world.rescore(draw, safe_log(self.scorer(fixed_val)))
+            if draw._logscore == NEG_INF:
                 raise ZeroProbabilityException
             return fixed_val
         else:
@@ -132,24 +279,29 @@ class Choice(object):
 
 class Draw(object):
 
-    def __init__(self, value, choice, tick_touched,
-                 tick_created=None, fixed=False):
+    __slots__ = ("value", "choice", "tick_touched", "fixed", "_logscore")
+
+    def __init__(self, value, choice, tick_touched, *, fixed=False,
+                 logscore=None):
         self.value = value
         self.choice = choice
         self.tick_touched = tick_touched
-        self.tick_created = tick_created or tick_touched
         self.fixed = fixed
+        if logscore is None:
+            logscore = safe_log(choice.scorer(value))
+        self._logscore = logscore
 
     def resample(self):
         self.value = self.choice.sampler()
+        self._logscore = safe_log(self.choice.scorer(self.value))
 
     @property
     def score(self):
-        return self.choice.scorer(self.value)
+        return math.exp(self._logscore)
 
     def copy(self):
         return Draw(self.value, self.choice, self.tick_touched,
-                    self.tick_created, self.fixed)
+                    fixed=self.fixed, logscore=self._logscore)
 
     def __repr__(self):
         return str(self.choice) + ": v=" + str(self.value) + \
@@ -157,39 +309,169 @@ class Draw(object):
 
 
 class World(dict):
+    """Maps names to draws; mutated in place and rolled back on rejection."""
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self)
+        self._log_score = 0.0
+        self._journal = None
+        self._saved_log_score = 0.0
+        self._proposable = []
+        self._proposable_index = {}
+        self._created = []
+        self.update(*args, **kwargs)
+        self._created = []
+
+    def __reduce__(self):
+        # Rebuild through __init__ so that copy, deepcopy and pickle
+        # recompute the bookkeeping instead of restoring it and then
+        # re-adding every draw on top.
+        return (World, (dict(self),))
+
+    def __setitem__(self, name, draw):
+        logscore, fixed = draw._logscore, draw.fixed
+        self.record(name)
+        if name in self:
+            self._log_score -= self[name]._logscore
+        else:
+            self._created.append(name)
+        dict.__setitem__(self, name, draw)
+        self._log_score += logscore
+        self.set_proposable(name, not fixed)
+
+    def __delitem__(self, name):
+        self.pop(name)
+
+    def pop(self, name, *default):
+        if default and name not in self:
+            return default[0]
+        draw = dict.pop(self, name)
+        if self._journal is not None and name not in self._journal:
+            self._journal[name] = draw
+        self._log_score -= draw._logscore
+        self.set_proposable(name, False)
+        return draw
+
+    def popitem(self):
+        if not self:
+            raise KeyError("popitem(): world is empty")
+        name = next(reversed(self))
+        return name, self.pop(name)
+
+    def clear(self):
+        for name in list(self):
+            self.pop(name)
+
+    def update(self, *args, **kwargs):
+        for (name, draw) in dict(*args, **kwargs).items():
+            self[name] = draw
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def setdefault(self, name, draw=None):
+        if name not in self:
+            self[name] = draw
+        return self[name]
+
+    @classmethod
+    def fromkeys(cls, names, draw=None):
+        world = cls()
+        for name in names:
+            world[name] = draw
+        return world
+
+    def set_proposable(self, name, proposable):
+        index = self._proposable_index
+        if proposable and name not in index:
+            index[name] = len(self._proposable)
+            self._proposable.append(name)
+        elif not proposable and name in index:
+            # Swap the last name into the freed slot.
+            i = index.pop(name)
+            last = self._proposable.pop()
+            if last != name:
+                self._proposable[i] = last
+                index[last] = i
+
+    def record(self, name):
+        journal = self._journal
+        if journal is not None and name not in journal:
+            draw = dict.get(self, name)
+            journal[name] = draw.copy() if draw is not None else None
+
+    def commit(self):
+        self._journal = None
+
+    def rollback(self):
+        journal, self._journal = self._journal, None
+        if journal is None:
+            return
+        for (name, draw) in journal.items():
+            if draw is None:
+                dict.pop(self, name)
+                self.set_proposable(name, False)
+            else:
+                dict.__setitem__(self, name, draw)
+                self.set_proposable(name, not draw.fixed)
+        self._log_score = self._saved_log_score
+
+    def rescore(self, draw, logscore):
+        self._log_score += logscore - draw._logscore
+        draw._logscore = logscore
+
+    def log_score(self):
+        return self._log_score
 
     def score(self):
-        return product([draw.score for draw in self.values()])
+        return math.exp(self._log_score)
 
     def copy(self):
         new_world = World()
         for (i, draw) in self.items():
-            new_world[i] = draw.copy()
+            dict.__setitem__(new_world, i, draw.copy())
+        new_world._log_score = self._log_score
+        new_world._proposable = list(self._proposable)
+        new_world._proposable_index = dict(self._proposable_index)
         return new_world
 
     def clean(self, tick):
-        inc_fw, inc_bw = 1, 1
-        for (name, draw) in self.items():
-            if draw.tick_created == tick:
-                inc_fw = draw.score * inc_fw
-            elif draw.tick_touched != tick:
-                self.pop(name)
-                inc_bw = draw.score * inc_bw
-        return inc_fw, inc_bw
+        # Draws inserted since the proposal started are the new ones, so
+        # only a single comparison per draw is needed to find stale ones.
+        log_inc_fw = sum(self[name]._logscore for name in self._created)
+        self._created = []
+        stale = [name for (name, draw) in self.items()
+                 if draw.tick_touched != tick]
+        log_inc_bw = sum(self.pop(name)._logscore for name in stale)
+        return log_inc_fw, log_inc_bw
 
     def propose(self, model, tick):
-        proposal = self.copy()
-        proposable_draws_pre = [d for d in proposal.values() if not d.fixed]
-        draw = random.choice(proposable_draws_pre)
-        draw_score_pre = draw.score
+        self._journal = {}
+        self._saved_log_score = self._log_score
+        num_proposable_pre = len(self._proposable)
+        name = random.choice(self._proposable)
+        self.record(name)
+        draw = self[name]
+        draw_logscore_pre = draw._logscore
         draw.resample()
-        draw_score_post = draw.score
-        new_world, new_value = model(proposal, tick)
-        inc_fw, inc_bw = new_world.clean(tick)
-        proposable_draws_post = [d for d in new_world.values() if not d.fixed]
-        bw = (1 / len(proposable_draws_post)) * draw_score_pre * inc_bw
-        fw = (1 / len(proposable_draws_pre)) * draw_score_post * inc_fw
-        return new_world, new_value, bw, fw
+        draw_logscore_post = draw._logscore
+        self._log_score += draw_logscore_post - draw_logscore_pre
+        if draw_logscore_post == NEG_INF:
+            return self, None, NEG_INF, 0.0, False
+        self._created = []
+        try:
+            new_world, new_value = model(self, tick)
+        except ZeroProbabilityException:
+            # The model hit a zero-probability draw and cannot continue
+            # with it; report the proposal as invalid so it gets rejected.
+            return self, None, NEG_INF, 0.0, False
+        log_inc_fw, log_inc_bw = new_world.clean(tick)
+        log_bw = (-math.log(len(new_world._proposable)) +
+                  draw_logscore_pre + log_inc_bw)
+        log_fw = (-math.log(num_proposable_pre) +
+                  draw_logscore_post + log_inc_fw)
+        return new_world, new_value, log_bw, log_fw, True
 
 
 def initialize(model, condition):
@@ -205,20 +487,26 @@ def mcmc(model, condition, query, num_steps, num_samples=None, runtime=None):
     results = {"samples": [],
                "timing": []}
     i = 0
+    tick = 0
     t_0 = datetime.now()
     t = 0
     while (num_samples and i < num_samples) or (runtime and t < runtime):
-        for j in range(num_steps):
-            try:
-                proposal, new_value, bw, fw = world.propose(model, i * j)
-            except ZeroProbabilityException:
-                pass
+        for _ in range(num_steps):
+            tick += 1
+            old_log_score = world.log_score()
+            proposal, new_value, log_bw, log_fw, valid = world.propose(
+                model, tick)
+            accepted = False
+            if valid and condition(new_value):
+                log_p = ((proposal.log_score() - old_log_score) +
+                         (log_bw - log_fw))
+                accepted = log_p >= 0 or flip(math.exp(log_p))
+            if accepted:
+                world.commit()
+                world, value = proposal, new_value
             else:
-                if condition(new_value):
-                    p = (proposal.score() / world.score()) * (bw / fw)
-                    if p >= 1 or flip(p):
-                        world, value = proposal, new_value
-            t = timedelta_to_seconds(datetime.now() - t_0)
+                world.rollback()
+            t = (datetime.now() - t_0).total_seconds()
             if runtime and t > runtime:
                 break
         query_value = query(value)
@@ -228,77 +516,115 @@ def mcmc(model, condition, query, num_steps, num_samples=None, runtime=None):
     return results
 
 
+def mcmc_parallel(num_chains, seed=0, **kwargs):
+    """Run num_chains mcmc chains in parallel; chain i uses seed + i."""
+    seeds = [seed + i for i in range(num_chains)]
+    chain_results = process_map(lambda _: mcmc(**kwargs), seeds,
+                                processes=num_chains, seeds=seeds)
+    return {"samples": [r["samples"] for r in chain_results],
+            "timing": [r["timing"] for r in chain_results]}
+
+
 # --------------------------------------------------------------------
 # Random primitives
 
+@lru_cache(maxsize=1024)
+def _cached_choice(build, *args):
+    # Choices are fully determined by their parameters, so one instance
+    # is shared by every call with the same arguments. Draws that keep
+    # their choice across a step then need no journaling or rescoring.
+    # Callers pass parameters as Python scalars so that 0-d arrays
+    # (e.g. from np.where) are hashable cache keys.
+    return build(*args)
+
+
+def _flip_choice(p):
+    q = 1 - p
+    return Choice(sampler=lambda: flip(p),
+                  scorer=lambda val: p if val else q,
+                  description="flip")
+
+
 def church_flip(world, name, tick, p):
-    choice = Choice(sampler=lambda: flip(p),
-                    scorer=lambda val: p if val else 1 - p,
-                    description="flip")
+    choice = _cached_choice(_flip_choice, float(p))
     return choice.sample(world, name, tick)
 
 
 def church_flip_fixed(world, name, tick, p, fixed_val):
-    choice = Choice(sampler=lambda: flip(p),
-                    scorer=lambda val: p if val else 1 - p,
-                    description="flip")
+    choice = _cached_choice(_flip_choice, float(p))
     return choice.set(world, name, tick, fixed_val)
 
 
 def sample_geometric(p):
-    if flip(p):
+    # Inverse-CDF draw: constant time, no recursion for small p.
+    if p >= 1:
         return 1
-    else:
-        return 1 + sample_geometric(p)
+    return int(math.floor(math.log1p(-_pool.uniform()) / math.log1p(-p))) + 1
 
 
 def score_geometric(p, n):
-    if n < 1:
-        return 0.0
-    else:
-        return (1 - p) ** (n - 1) * p
+    return _cached_choice(_geometric_choice, float(p)).scorer(n)
+
+
+def _geometric_choice(p):
+    log1mp = math.log1p(-p) if p < 1 else NEG_INF
+    logp = safe_log(p)
+
+    def scorer(n):
+        if n < 1:
+            return 0.0
+        elif n == 1:
+            return p
+        else:
+            return math.exp((n - 1) * log1mp + logp)
+
+    return Choice(sampler=lambda: sample_geometric(p),
+                  scorer=scorer,
+                  description="geometric")
 
 
 def church_geometric(world, name, tick, p):
-    choice = Choice(sampler=lambda: sample_geometric(p),
-                    scorer=lambda v: score_geometric(p, v),
-                    description="geometric")
+    choice = _cached_choice(_geometric_choice, float(p))
     return choice.sample(world, name, tick)
 
 
 def sample_uniform(low, high):
-    return np.random.uniform(low, high)
+    return low + (high - low) * _pool.uniform()
 
 
 def score_uniform(low, high, v):
-    if v < low or v > high:
-        return 0.0
-    else:
-        return 1.0 / (high - low)
+    return _cached_choice(_uniform_choice, float(low), float(high)).scorer(v)
+
+
+def _uniform_choice(low, high):
+    density = 1.0 / (high - low)
+    return Choice(sampler=lambda: sample_uniform(low, high),
+                  scorer=lambda v: density if low <= v <= high else 0.0,
+                  description="uniform")
 
 
 def church_uniform(world, name, tick, low, high):
-    choice = Choice(sampler=lambda: sample_uniform(low, high),
-                    scorer=lambda v: score_uniform(low, high, v),
-                    description="uniform")
+    choice = _cached_choice(_uniform_choice, float(low), float(high))
     return choice.sample(world, name, tick)
 
 
 def sample_integer(low, high):
-    return np.random.randint(low, high)
+    return low + int((high - low) * _pool.uniform())
 
 
 def score_integer(low, high, v):
-    if v < low or v >= high:
-        return 0.0
-    else:
-        return 1.0 / (high - low)
+    return _cached_choice(_integer_choice, int(low), int(high)).scorer(v)
+
+
+def _integer_choice(low, high):
+    density = 1.0 / (high - low)
+    return Choice(sampler=lambda: sample_integer(low, high),
+                  scorer=lambda v: density if low <= v < high else 0.0,
+                  description="sample_int")
 
 
 def church_sampleinteger(world, name, tick, low, high):
-    choice = Choice(sampler=lambda: sample_integer(low, high),
-                    scorer=lambda v: score_integer(low, high, v),
-                    description="sample_int")
+    choice = _cached_choice(_integer_choice, int(low), int(high))
     return choice.sample(world, name, tick)
 
 
@@ -308,28 +634,45 @@ def church_listdraw(world, name, tick, lst):
 
 
 def sample_binomial(n, p):
-    return np.random.binomial(n, p)
+    return _pool.rng.binomial(n, p)
 
 
-@memoize
+@lru_cache(maxsize=4096)
+def _log_binomial_coefficient(n, k):
+    return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+
+
+def _binomial_pmf(log_coefficient, n, k, p):
+    if p <= 0.0:
+        return 1.0 if k == 0 else 0.0
+    if p >= 1.0:
+        return 1.0 if k == n else 0.0
+    return math.exp(log_coefficient +
+                    k * math.log(p) + (n - k) * math.log1p(-p))
+
+
+@lru_cache(maxsize=4096)
 def score_binomial(n, k, p):
-    if k > n:
+    if k < 0 or k > n:
         return 0.0
-    else:
-        return binom.pmf(k, n, p)
+    return _binomial_pmf(_log_binomial_coefficient(n, k), n, k, p)
+
+
+def _binomial_choice(n, p, description):
+    return Choice(sampler=lambda: sample_binomial(n, p),
+                  scorer=lambda k: score_binomial(n, k, p),
+                  description=description)
 
 
 def church_binomial(world, name, tick, n, p):
-    choice = Choice(sampler=lambda: sample_binomial(n, p),
-                    scorer=lambda k: score_binomial(n, k, p),
-                    description="binomial")
+    choice = _cached_choice(_binomial_choice, int(n), float(p),
+                            "binomial")
     return choice.sample(world, name, tick)
 
 
 def church_binomial_fixed(world, name, tick, n, p, fixed_val):
-    choice = Choice(sampler=lambda: sample_binomial(n, p),
-                    scorer=lambda k: score_binomial(n, k, p),
-                    description="binomial/fixed")
+    choice = _cached_choice(_binomial_choice, int(n), float(p),
+                            "binomial/fixed")
     return choice.set(world, name, tick, fixed_val)
 
 
@@ -338,8 +681,7 @@ def church_binomial_fixed(world, name, tick, n, p, fixed_val):
 
 def test_constraints():
 
-    def model(init_world, tick):
-        world = init_world.copy()
+    def model(world, tick):
         A = church_flip(world, "B", tick, .5)
         B_w = .00001 if A else .00002
         B = church_flip_fixed(world, "A", tick, B_w, True)
@@ -349,8 +691,7 @@ def test_constraints():
 
     query = lambda val: val["A"]
 
-    np.random.seed(7)
-    random.seed(7)
+    random_seed(7)
 
     mcmc_results = mcmc(model, condition, query, num_steps=100, num_samples=173)
     mcmc_samples = mcmc_results["samples"]
@@ -359,8 +700,7 @@ def test_constraints():
 
 def test_transdimensional():
 
-    def model(init_world, tick):
-        world = init_world.copy()
+    def model(world, tick):
         rbit = lambda name: church_flip(world, name, tick, .5)
         A = rbit("a")
         if A:
@@ -376,12 +716,22 @@ def test_transdimensional():
 
     query = lambda val: val["A"]
 
+    def model_batch(size):
+        A = flips(.5, size)
+        z = flips(.5, (size, 50)).sum(axis=1)
+        B = np.where(A, flips(.5, size), (z % 2) == 1)
+        C = flips(np.where(B, 1 / 3, 2 / 3), size)
+        return {"A": A, "B": B, "C": C}
+
     random_seed(9)
 
     rejection_samples = rejection(model, condition, query, num_samples=500)
+    batch_samples = rejection_batch(model_batch, condition, query,
+                                    num_samples=500)
     mcmc_results = mcmc(model, condition, query, num_steps=1000, num_samples=100)
     mcmc_samples = mcmc_results["samples"]
     print(histogram(rejection_samples))
+    print(histogram(batch_samples))
     print(histogram(mcmc_samples))
 
 
@@ -402,8 +752,7 @@ def test_hierarchical():
         9: 10
         }
 
-    def model(init_world, tick, data=observed_samples):
-        world = init_world.copy()
+    def model(world, tick, data=observed_samples):
         num_bag_types = church_geometric(world, "num_bag_types", tick, .4)
         bag_ps = [church_uniform(world, "bag_type_p_%i" % i, tick, 0, 1)
                   for i in range(num_bag_types)]
@@ -437,7 +786,8 @@ def test_hierarchical():
 
     all_results = mapp(lambda f: f(), [runmcmc] * 5)
     for result in all_results:
-        print result
+        print(result)
 
 
-test_hierarchical()
+if __name__ == "__main__":
+    test_hierarchical()